@@ -1,9 +1,19 @@
 import streamlit as st
-from openai import OpenAI
-from supabase import create_client
 from datetime import datetime
+import logging
 import random
 import time
+import conversation_store
+import input_admission
+import llm_pipeline
+import completion_cache
+
+logger = logging.getLogger(__name__)
+# -----------------------------
+# Page setup (older streamlit requires set_page_config to be the first st call)
+# -----------------------------
+st.set_page_config(page_title="A window into the future", layout="centered")
+st.title("A window into the future")
 # -----------------------------
 # UI/UX
 # -----------------------------
@@ -18,16 +28,14 @@ st.markdown(
     unsafe_allow_html=True
 )
 # -----------------------------
-# iMessage-style thinking
+# iMessage-style thinking (one frame per poll)
 # -----------------------------
-def thinking_animation(placeholder, duration=3.8, interval=0.4):
-    dots = [".", "..", "..."]
-    start = time.time()
-    i = 0
-    while time.time() - start < duration:
-        placeholder.markdown(dots[i % len(dots)])
-        time.sleep(interval)
-        i += 1
+THINKING_DOTS = [".", "..", "..."]
+POLL_INTERVAL = 0.4
+
+
+def thinking_frame(placeholder, elapsed):
+    placeholder.markdown(THINKING_DOTS[int(elapsed / POLL_INTERVAL) % len(THINKING_DOTS)])
 # -----------------------------
 # Log_Supabase
 # -----------------------------
@@ -36,31 +44,105 @@ def insert_log(
     stage,
     turn,
     user_message,
-    assistant_message
+    assistant_message,
+    input_tokens=None,
+    input_trimmed=False
 ):
+    if STORAGE_MODE == conversation_store.APPEND_ONLY:
+        # session row (condition, prompt version, welcome) 한 번만
+        if st.session_state.log_seq == 0:
+            conversation_store.start_session(
+                supabase,
+                finish_code=finish_code,
+                condition=CONDITION,
+                system_prompt=SYSTEM_PROMPT,
+                welcome_message=st.session_state.messages[0]["content"]
+            )
+        conversation_store.append_turn(
+            supabase,
+            finish_code=finish_code,
+            seq=st.session_state.log_seq,
+            stage=stage,
+            turn=turn,
+            user_message=user_message,
+            assistant_message=assistant_message,
+            input_tokens=input_tokens,
+            input_trimmed=input_trimmed,
+            compress=COMPRESS_LOGS
+        )
+        st.session_state.log_seq += 1
+        return
+
     supabase.table("chat_logs").insert({
         "finish_code": finish_code,
         "stage": stage,
         "turn": turn,
         "user_message": user_message,
-        "assistant_message": assistant_message
+        "assistant_message": assistant_message,
+        **({"condition": CONDITION} if LOG_CONDITION else {}),
+        **conversation_store.admission_columns(input_tokens, input_trimmed)
+    }).execute()
+
+
+def save_conversation():
+    # returns the insert future; pending_save() checks that it went through
+    admission_stats = st.session_state.admission_stats if LOG_INPUT_ADMISSION else None
+    if STORAGE_MODE == conversation_store.APPEND_ONLY:
+        # turns are already stored; transcript = full_conversations_view
+        return conversation_store.complete_session(
+            supabase,
+            finish_code=st.session_state.finish_code,
+            turns=st.session_state.log_seq,
+            admission_stats=admission_stats
+        )
+    return supabase.table("full_conversations").insert({
+        "finish_code": st.session_state.finish_code,
+        "full_conversation": [
+            {"role": m["role"], "content": m["content"]}
+            for m in st.session_state.messages
+        ],
+        "finished_at": datetime.utcnow().isoformat(),
+        **conversation_store.admission_totals(admission_stats)
     }).execute()
 # -----------------------------
-# Page setup
-# -----------------------------
-st.set_page_config(page_title="A window into the future", layout="centered")
-st.title("A window into the future")
-# -----------------------------
-# OpenAI client
+# OpenAI (requests run on the shared llm_pipeline loop)
 # -----------------------------
-client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+OPENAI_API_KEY = st.secrets["OPENAI_API_KEY"]
+# record/replay cache for development and demos (passthrough in the study)
+COMPLETION_CACHE = completion_cache.CompletionCache(
+    mode=st.secrets.get("COMPLETION_CACHE", completion_cache.PASSTHROUGH),
+    directory=st.secrets.get("COMPLETION_CACHE_DIR", completion_cache.CACHE_DIR),
+    max_mb=float(st.secrets.get("COMPLETION_CACHE_MAX_MB", completion_cache.MAX_MB))
+)
 # -----------------------------
-# Supabase
+# Supabase (inserts run on the shared llm_pipeline loop)
 # -----------------------------
-supabase = create_client(
+supabase = llm_pipeline.SupabaseWriter(
     st.secrets["SUPABASE_URL"],
     st.secrets["SUPABASE_SERVICE_KEY"]
 )
+# -----------------------------
+# Storage mode
+# -----------------------------
+CONDITION = "no_embodiment"
+STORAGE_MODE = conversation_store.check_storage_mode(
+    st.secrets.get("STORAGE_MODE", conversation_store.FULL_TRANSCRIPT)
+)
+COMPRESS_LOGS = conversation_store.parse_flag(st.secrets.get("COMPRESS_LOGS", False))
+# chat_logs.condition (full_transcript) is written only after sql/chat_logs_condition.sql has run
+LOG_CONDITION = conversation_store.parse_flag(st.secrets.get("LOG_CONDITION", False))
+# -----------------------------
+# Animation timing (0 = no delays, e.g. for benchmarks)
+# -----------------------------
+ANIMATION_SCALE = float(st.secrets.get("ANIMATION_SCALE", 1.0))
+# -----------------------------
+# Input admission (token budgets for participant messages)
+# -----------------------------
+MESSAGE_TOKEN_BUDGET = int(st.secrets.get("MESSAGE_TOKEN_BUDGET", input_admission.MESSAGE_TOKEN_BUDGET))
+SESSION_TOKEN_BUDGET = int(st.secrets.get("SESSION_TOKEN_BUDGET", input_admission.SESSION_TOKEN_BUDGET))
+# input_tokens / input_trimmed (chat_logs) and the per-session input_messages /
+# input_trimmed_messages (final save row) are written only after sql/input_admission.sql has run
+LOG_INPUT_ADMISSION = conversation_store.parse_flag(st.secrets.get("LOG_INPUT_ADMISSION", False))
 
 # -----------------------------
 # Session state initialization
@@ -86,6 +168,24 @@ if "stage" not in st.session_state:
 if "turn" not in st.session_state:
     st.session_state.turn = 0
 
+if "log_seq" not in st.session_state:
+    st.session_state.log_seq = 0
+
+if "input_tokens_sent" not in st.session_state:
+    st.session_state.input_tokens_sent = 0
+
+if "admission_stats" not in st.session_state:
+    st.session_state.admission_stats = {"messages": 0, "trimmed": 0}
+
+if "pending_reply" not in st.session_state:
+    st.session_state.pending_reply = None
+
+if "reply_error" not in st.session_state:
+    st.session_state.reply_error = None
+
+if "pending_save" not in st.session_state:
+    st.session_state.pending_save = None
+
 if "finished" not in st.session_state:
     st.session_state.finished = False
 # -----------------------------
@@ -231,26 +331,25 @@ for msg in st.session_state.messages:
     else:
         with st.chat_message("user"):
             st.markdown(msg["content"])
-# -----------------------------
-# User input
-# -----------------------------
-user_input = st.chat_input("Type your message here")
 
-#USER MESSAGE
-if user_input:
-    st.session_state.messages.append(
-        {"role": "user", "content": user_input}
-    )
-    st.rerun()
+if st.session_state.reply_error:
+    st.error(st.session_state.reply_error)
 # -----------------------------
 # ASSISTANT RESPONSE GENERATION
 # -----------------------------
 if (
     not st.session_state.gave_finish_code
+    and st.session_state.pending_reply is None
     and st.session_state.messages
     and st.session_state.messages[-1]["role"] == "user"
 ):
-    last_user_input = st.session_state.messages[-1]["content"]
+    last_user_message = st.session_state.messages[-1]
+    last_user_input = last_user_message["content"]
+    # put back by discard_turn() if the reply fails
+    restore = {
+        "stage": st.session_state.stage,
+        "turn": st.session_state.turn
+    }
 
     # -----------------------------
     # Stage & turn management
@@ -277,66 +376,149 @@ if (
         "role": "system",
         "content": f"You are currently responding in STEP {st.session_state.current_step}. Respond ONLY for this step."
     },
-    *st.session_state.messages
+    *[
+        {"role": msg["role"], "content": msg.get("model_content", msg["content"])}
+        for msg in st.session_state.messages
+    ]
     ]
 
     # -----------------------------
-    # Assistant bubble
+    # Animation schedule
     # -----------------------------
-    with st.chat_message("assistant", avatar="🌍"):
-        placeholder = st.empty()
+    # 모든 턴에서 0.2초 후 대기, 이후 dots (1.2초)
+    connect_time, dots_time = 0, 1.2
 
-        # 모든 턴에서 0.2초 후 대기
-        time.sleep(0.2)
-        thinking_animation(placeholder, duration=1.2)
-
-        # OpenAI 호출
-        response = client.chat.completions.create(
+    # -----------------------------
+    # OpenAI 호출 (애니메이션과 동시에 진행)
+    # -----------------------------
+    st.session_state.pending_reply = {
+        "future": llm_pipeline.submit_completion(
+            OPENAI_API_KEY,
             model="gpt-4.1",
             messages=messages_for_api,
             temperature=0.8,
-        )
+            cache=COMPLETION_CACHE
+        ),
+        "user_index": len(st.session_state.messages) - 1,
+        "restore": restore,
+        "started": time.time(),
+        "delay": 0.2 * ANIMATION_SCALE,
+        "connecting": connect_time * ANIMATION_SCALE,
+        "dots": dots_time * ANIMATION_SCALE
+    }
+# -----------------------------
+# User input
+# -----------------------------
+# after the generation block, so the box is already disabled in the run that
+# submits the request (fragment polls don't rerun this part of the page)
+user_input = st.chat_input(
+    "Type your message here",
+    disabled=st.session_state.pending_reply is not None
+)
 
-        assistant_message = response.choices[0].message.content
-        # -----------------------------
-        # Step progression logic
-        # -----------------------------
-        # step 1 → step 2 : 항상 한 번만
-        if st.session_state.current_step == 1:
-            st.session_state.current_step = 2
-        
-        # step 2 → step 3 : 환경 맥락이 등장하면
-        elif st.session_state.current_step == 2:
-            env_signals = [
-                "climate", "heat", "weather", "energy",
-                "air", "water", "carbon"
-            ]
-            if any(s in assistant_message.lower() for s in env_signals):
-                st.session_state.current_step = 3
-        
-        # step 3 → step 4 : 삶의 영향/손실이 드러나면 (자연스러운 전이)
-        elif st.session_state.current_step == 3:
-            loss_signals = [
-                "daily life", "harder", "difficult", "loss",
-                "no longer", "miss", "used to", "my generation"
-            ]
-            if any(s in assistant_message.lower() for s in loss_signals):
-                st.session_state.current_step = 4
-        
-        # step 4 → step 5 : 반드시 한 번
-        elif st.session_state.current_step == 4:
-            st.session_state.current_step = 5
-        
-        # step 5 : finish code 발급 + 종료
-        elif st.session_state.current_step == 5:
-            assistant_message += f"\n\nYour finish code is **{st.session_state.finish_code}**."
-            st.session_state.gave_finish_code = True
-            st.session_state.finished = True
-            st.session_state.current_step = 6
-        # -----------------------------
-        # 메시지 출력 (딱 한 번만)
-        # -----------------------------
-        placeholder.markdown(assistant_message)
+#USER MESSAGE
+if user_input:
+    # 원문은 화면/로그용, 모델에는 예산 안의 content만 전송
+    admission = input_admission.admit(
+        user_input,
+        session_tokens=st.session_state.input_tokens_sent,
+        message_budget=MESSAGE_TOKEN_BUDGET,
+        session_budget=SESSION_TOKEN_BUDGET
+    )
+    st.session_state.input_tokens_sent += admission["sent_tokens"]
+    st.session_state.admission_stats["messages"] += 1
+    st.session_state.reply_error = None
+
+    user_message = {
+        "role": "user",
+        "content": user_input,
+        "tokens": admission["tokens"],
+        "sent_tokens": admission["sent_tokens"],
+        "trimmed": admission["trimmed"]
+    }
+    if admission["trimmed"]:
+        user_message["model_content"] = admission["content"]
+        st.session_state.admission_stats["trimmed"] += 1
+    st.session_state.messages.append(user_message)
+    st.rerun()
+# -----------------------------
+# Assistant bubble (polled: no thread waits for the reply)
+# -----------------------------
+def discard_turn(job):
+    # drop the unanswered message and undo its bookkeeping so it can be sent again
+    user_message = st.session_state.messages.pop(job["user_index"])
+    for key, value in job["restore"].items():
+        st.session_state[key] = value
+    st.session_state.input_tokens_sent -= user_message["sent_tokens"]
+    st.session_state.admission_stats["messages"] -= 1
+    if user_message["trimmed"]:
+        st.session_state.admission_stats["trimmed"] -= 1
+
+
+@st.fragment(run_every=POLL_INTERVAL)
+def pending_reply():
+    job = st.session_state.pending_reply
+    if job is None:
+        return  # answered; the timer can tick once more before the full rerun
+    elapsed = time.time() - job["started"]
+    animation_time = job["delay"] + job["connecting"] + job["dots"]
+
+    with st.chat_message("assistant", avatar="🌍"):
+        placeholder = st.empty()
+        if elapsed < job["delay"]:
+            pass  # 모든 턴에서 0.2초 대기
+        elif job["dots"]:
+            thinking_frame(placeholder, elapsed)
+
+    if not job["future"].done() or elapsed < animation_time:
+        return
+
+    st.session_state.pending_reply = None
+    try:
+        assistant_message = job["future"].result()
+    except Exception:
+        logger.exception("reply for %s failed", st.session_state.finish_code)
+        discard_turn(job)
+        st.session_state.reply_error = (
+            "Sorry, the reply could not be generated. Please send your message again."
+        )
+        st.rerun()
+    last_user_message = st.session_state.messages[job["user_index"]]
+    # -----------------------------
+    # Step progression logic
+    # -----------------------------
+    # step 1 → step 2 : 항상 한 번만
+    if st.session_state.current_step == 1:
+        st.session_state.current_step = 2
+    
+    # step 2 → step 3 : 환경 맥락이 등장하면
+    elif st.session_state.current_step == 2:
+        env_signals = [
+            "climate", "heat", "weather", "energy",
+            "air", "water", "carbon"
+        ]
+        if any(s in assistant_message.lower() for s in env_signals):
+            st.session_state.current_step = 3
+    
+    # step 3 → step 4 : 삶의 영향/손실이 드러나면 (자연스러운 전이)
+    elif st.session_state.current_step == 3:
+        loss_signals = [
+            "daily life", "harder", "difficult", "loss",
+            "no longer", "miss", "used to", "my generation"
+        ]
+        if any(s in assistant_message.lower() for s in loss_signals):
+            st.session_state.current_step = 4
+    
+    # step 4 → step 5 : 반드시 한 번
+    elif st.session_state.current_step == 4:
+        st.session_state.current_step = 5
+    
+    # step 5 : finish code 발급 + 종료
+    elif st.session_state.current_step == 5:
+        assistant_message += f"\n\nYour finish code is **{st.session_state.finish_code}**."
+        st.session_state.gave_finish_code = True
+        st.session_state.finished = True
+        st.session_state.current_step = 6
     # -----------------------------
     # Session history 저장
     # -----------------------------
@@ -350,8 +532,10 @@ if (
         finish_code=st.session_state.finish_code,
         stage=st.session_state.stage,
         turn=st.session_state.turn,
-        user_message=last_user_input,
-        assistant_message=assistant_message
+        user_message=last_user_message["content"],
+        assistant_message=assistant_message,
+        input_tokens=last_user_message.get("tokens") if LOG_INPUT_ADMISSION else None,
+        input_trimmed=last_user_message.get("trimmed", False)
     )
     # -----------------------------
     # Full conversation 저장 (한 번만)
@@ -360,18 +544,38 @@ if (
         st.session_state.gave_finish_code
         and not st.session_state.get("saved", False)
     ):
-        supabase.table("full_conversations").insert({
-            "finish_code": st.session_state.finish_code,
-            "full_conversation": st.session_state.messages,
-            "finished_at": datetime.utcnow().isoformat()
-        }).execute()
-
+        st.session_state.pending_save = {"future": save_conversation(), "failed": False}
         st.session_state.saved = True
 
     # -----------------------------
     # rerun (항상 맨 마지막)
     # -----------------------------
     st.rerun()
+# -----------------------------
+# Final save confirmation (polled)
+# -----------------------------
+@st.fragment(run_every=POLL_INTERVAL)
+def pending_save():
+    job = st.session_state.pending_save
+    if job is None:
+        return
+    if job["future"].done():
+        if job["future"].exception() is None:
+            st.session_state.pending_save = None
+            # full rerun: the fragment is no longer called, so its timer stops
+            st.rerun()
+        # retries in llm_pipeline are used up; queue it again while the page is open
+        job = st.session_state.pending_save = {"future": save_conversation(), "failed": True}
+    if job["failed"]:
+        st.warning("Your conversation has not been saved yet. Please keep this page open.")
+
+
+if st.session_state.pending_reply is not None:
+    pending_reply()
+
+if st.session_state.pending_save is not None:
+    pending_save()
+
 
 
 
@@ -0,0 +1,351 @@
+"""Per-turn performance regression suite for the Streamlit apps.
+
+Runs app_Version2.py and No_Embodiment.py headlessly with Streamlit's AppTest,
+stubbed async OpenAI and Supabase clients on the llm_pipeline loop and
+ANIMATION_SCALE = 0.
+Each app is driven through scripted conversations of several lengths and, per
+turn, we record CPU time, peak Python allocations (tracemalloc) and the number
+of rendered deltas. Results are compared with benchmarks/baselines.json.
+CPU and allocation baselines are machine-specific; refresh them with --update
+when moving to a different machine.
+
+    python benchmarks/bench_apps.py                 # compare, exit 1 on regression
+    python benchmarks/bench_apps.py --update        # rewrite baselines
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import re
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest
+
+try:
+    from streamlit.runtime.scriptrunner_utils.script_run_context import ScriptRunContext
+except ImportError:  # streamlit < 1.38
+    from streamlit.runtime.scriptrunner.script_run_context import ScriptRunContext
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import conversation_store  # noqa: E402
+import llm_pipeline  # noqa: E402
+
+BASELINES = Path(__file__).resolve().parent / "baselines.json"
+
+APPS = {
+    "embodiment": ROOT / "app_Version2.py",
+    "no_embodiment": ROOT / "No_Embodiment.py",
+}
+LENGTHS = (5, 15, 40)
+
+# regression = current > baseline * (1 + tolerance)
+TOLERANCES = {
+    "cpu_ms_mean": 0.30,
+    "cpu_ms_max": 0.50,
+    "alloc_kib_peak": 0.15,
+    "renders_mean": 0.02,
+    "db_writes": 0.0,
+    "db_write_kib": 0.05,
+}
+# -----------------------------
+# Scripted conversation
+# -----------------------------
+# Replies are chosen from the STEP system message so the app's own
+# step-progression scans decide when to advance. Aside questions get a reply
+# with none of the env/loss signal substrings, so the step does not move.
+STEP_REPLIES = {
+    1: "Nice to meet you. What is one small routine you do almost every day?",
+    2: (
+        "If I tried to do that here, the heat would stop me before noon. "
+        "The climate shifted slowly, then the water rationing began. "
+    ) * 4,
+    3: (
+        "When I was five we used to open the windows every evening. "
+        "Now I miss the breeze more than anything, and daily life is harder. "
+    ) * 4,
+    4: (
+        "**Big-picture actions**:\n\n- Push for urban green spaces.\n\n"
+        "**Everyday Micro Habits**:\n\n- Purchase only what is necessary.\n\n"
+        "Would you like your finish code?"
+    ),
+    5: "Thank you for talking with me today.",
+}
+ASIDE_REPLY = (
+    "Good question. It is a term we use for the city zones with shared "
+    "shelters. Let me get back to what I was telling you. "
+) * 3
+ASIDE_QUESTIONS = (
+    "Sorry, what does that mean?",
+    "Can you explain that term?",
+    "How do people get around there?",
+)
+OPENING_MESSAGES = ["Yes, I'm ready", "Pretty good, thanks. A bit busy."]
+CLOSING_MESSAGES = [
+    "I walk my dog every morning.",
+    "Yes, I did that a lot growing up.",
+    "Yes please, I'd like the finish code.",
+]
+STEP_PATTERN = re.compile(r"STEP (\d+)")
+
+# session_state is seeded from outside a script run; silence the bare-mode warning
+logging.getLogger(ScriptRunContext.__module__).disabled = True
+
+
+def conversation(length):
+    asides = max(length - len(OPENING_MESSAGES) - len(CLOSING_MESSAGES), 0)
+    middle = [ASIDE_QUESTIONS[i % len(ASIDE_QUESTIONS)] for i in range(asides)]
+    return OPENING_MESSAGES + middle + CLOSING_MESSAGES
+# -----------------------------
+# Stubs
+# -----------------------------
+# Replies are held until the submitting script run has finished, so every turn
+# takes the same path: submit -> one poll that renders the reply -> rerun.
+class ReplyGate:
+    def __init__(self):
+        self.event = None
+
+    async def _new_event(self):
+        self.event = asyncio.Event()
+
+    def hold(self):
+        # the event must be created on the llm_pipeline loop
+        llm_pipeline.submit(self._new_event()).result()
+
+    def release(self):
+        llm_pipeline.get_loop().call_soon_threadsafe(self.event.set)
+
+    async def wait(self):
+        await self.event.wait()
+
+
+REPLY_GATE = ReplyGate()
+
+
+class FakeCompletions:
+    async def create(self, model, messages, temperature=None, **kwargs):
+        await REPLY_GATE.wait()
+        step = 0
+        for message in messages:
+            if message["role"] == "system":
+                match = STEP_PATTERN.search(message["content"])
+                if match:
+                    step = int(match.group(1))
+        last_user = messages[-1]["content"]
+        if last_user in ASIDE_QUESTIONS:
+            content = ASIDE_REPLY
+        else:
+            content = STEP_REPLIES.get(step, ASIDE_REPLY)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))]
+        )
+
+
+class FakeOpenAI:
+    def __init__(self, *args, **kwargs):
+        self.chat = SimpleNamespace(completions=FakeCompletions())
+
+
+class FakeQuery:
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+
+    def insert(self, row):
+        self.db.writes += 1
+        self.db.write_bytes += len(json.dumps(row, ensure_ascii=False).encode("utf-8"))
+        return self
+
+    def __getattr__(self, name):
+        # select / eq / order / limit / ... are no-ops
+        return lambda *args, **kwargs: self
+
+    async def execute(self):
+        return SimpleNamespace(data=[])
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.writes = 0
+        self.write_bytes = 0
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+def fake_supabase_factory(db):
+    async def acreate_client(url, key):
+        return db
+    return acreate_client
+# -----------------------------
+# Measurement
+# -----------------------------
+class RenderCounter:
+    def __init__(self):
+        self.deltas = 0
+        self._enqueue = ScriptRunContext.enqueue
+
+    def __enter__(self):
+        counter = self
+        original = self._enqueue
+
+        def enqueue(ctx, msg):
+            if msg.WhichOneof("type") == "delta":
+                counter.deltas += 1
+            return original(ctx, msg)
+
+        ScriptRunContext.enqueue = enqueue
+        return self
+
+    def __exit__(self, *exc):
+        ScriptRunContext.enqueue = self._enqueue
+
+
+def new_app(path, storage_mode):
+    at = AppTest.from_file(str(path), default_timeout=60)
+    at.secrets["OPENAI_API_KEY"] = "sk-bench"
+    at.secrets["SUPABASE_URL"] = "http://localhost"
+    at.secrets["SUPABASE_SERVICE_KEY"] = "bench"
+    at.secrets["STORAGE_MODE"] = storage_mode
+    at.secrets["ANIMATION_SCALE"] = 0.0
+    return at
+
+
+def run_conversation(path, length, storage_mode, trace_allocs):
+    db = FakeSupabase()
+    turns = []
+    # AppTest builds a new ScriptCache (and recompiles the script) on every
+    # run; the server compiles once, so share one cache like the server does
+    script_cache = ScriptCache()
+    llm_pipeline._openai_clients.clear()
+    llm_pipeline._supabase_clients.clear()
+    with mock.patch.object(llm_pipeline, "AsyncOpenAI", FakeOpenAI), \
+            mock.patch.object(llm_pipeline, "acreate_client", fake_supabase_factory(db)), \
+            mock.patch("streamlit.testing.v1.local_script_runner.ScriptCache", lambda: script_cache), \
+            RenderCounter() as renders:
+        at = new_app(path, storage_mode)
+        at.run()
+        # the apps start at step 0 and wait for step 1; begin the scripted
+        # flow at step 1 so the step-4 and finish-code paths are exercised
+        at.session_state["current_step"] = 1
+
+        for text in conversation(length):
+            deltas_before = renders.deltas
+            REPLY_GATE.hold()
+            # keep collector pauses out of the per-turn numbers
+            gc.collect()
+            gc.disable()
+            if trace_allocs:
+                tracemalloc.start()
+            cpu_before = time.process_time()
+            at.chat_input[0].set_value(text).run()
+            REPLY_GATE.release()
+            # AppTest has no fragment-only reruns, so the poll that renders the
+            # reply is a full run here (the server reruns just the fragment)
+            while at.session_state["pending_reply"] is not None:
+                at.session_state["pending_reply"]["future"].result()
+                at.run()
+            cpu_ms = (time.process_time() - cpu_before) * 1000
+            gc.enable()
+            alloc_kib = 0.0
+            if trace_allocs:
+                alloc_kib = tracemalloc.get_traced_memory()[1] / 1024
+                tracemalloc.stop()
+            if at.exception:
+                raise RuntimeError(f"{path.name}: {at.exception[0].value}")
+            turns.append({
+                "cpu_ms": cpu_ms,
+                "alloc_kib": alloc_kib,
+                "renders": renders.deltas - deltas_before,
+            })
+
+        if not at.session_state["gave_finish_code"]:
+            raise RuntimeError(f"{path.name}: conversation did not reach the finish code")
+        llm_pipeline.flush(timeout=10)
+    return turns, db
+
+
+def measure(path, length, storage_mode, repeat):
+    # CPU: best of `repeat` runs without tracemalloc; allocations: one traced run
+    cpu_runs = [run_conversation(path, length, storage_mode, False)[0] for _ in range(repeat)]
+    traced, db = run_conversation(path, length, storage_mode, True)
+    per_turn_cpu = [min(run[i]["cpu_ms"] for run in cpu_runs) for i in range(len(traced))]
+    return {
+        "turns": len(traced),
+        "cpu_ms_mean": round(sum(per_turn_cpu) / len(per_turn_cpu), 3),
+        "cpu_ms_max": round(max(per_turn_cpu), 3),
+        "alloc_kib_peak": round(max(t["alloc_kib"] for t in traced), 1),
+        "renders_mean": round(sum(t["renders"] for t in traced) / len(traced), 2),
+        "db_writes": db.writes,
+        "db_write_kib": round(db.write_bytes / 1024, 2),
+    }
+
+
+def compare(results, baselines):
+    regressions = []
+    for key, metrics in results.items():
+        base = baselines.get(key)
+        if base is None:
+            print(f"  {key}: no baseline")
+            continue
+        for metric, tolerance in TOLERANCES.items():
+            if metric not in base:
+                continue
+            limit = base[metric] * (1 + tolerance)
+            if metrics[metric] > limit + 1e-9:
+                regressions.append(
+                    f"{key} {metric}: {metrics[metric]} > {base[metric]} (+{tolerance:.0%})"
+                )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--apps", nargs="+", choices=sorted(APPS), default=sorted(APPS))
+    parser.add_argument("--lengths", nargs="+", type=int, default=list(LENGTHS))
+    parser.add_argument(
+        "--storage-modes", nargs="+", choices=conversation_store.STORAGE_MODES,
+        default=list(conversation_store.STORAGE_MODES)
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baselines", type=Path, default=BASELINES)
+    parser.add_argument("--update", action="store_true", help="write results as the new baselines")
+    args = parser.parse_args(argv)
+
+    # first AppTest run in a process pays for imports and caches; discard it
+    run_conversation(APPS[args.apps[0]], min(args.lengths), args.storage_modes[0], False)
+
+    results = {}
+    for storage_mode in args.storage_modes:
+        for app in args.apps:
+            for length in args.lengths:
+                key = f"{app}/{storage_mode}/{length}"
+                results[key] = measure(APPS[app], length, storage_mode, args.repeat)
+                print(key, json.dumps(results[key]))
+
+    baselines = {}
+    if args.baselines.exists():
+        baselines = json.loads(args.baselines.read_text())
+
+    if args.update:
+        baselines.update(results)
+        args.baselines.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        print(f"baselines written to {args.baselines}")
+        return 0
+
+    regressions = compare(results, baselines)
+    for line in regressions:
+        print("REGRESSION", line)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,286 @@
+"""Thread count and memory with many sessions waiting on the model at once.
+
+Compares the two ways a turn can wait for gpt-4.1:
+
+  threaded  the previous design: each session's script thread sleeps through
+            the thinking animation, then blocks in a sync OpenAI call
+  async     llm_pipeline: the request runs on the shared event loop and the
+            session polls for it (one poller thread stands in for the
+            short fragment ticks)
+
+Both talk to a local fake OpenAI server that answers after --latency seconds,
+and each design runs in its own process so peak RSS is not shared. Failed
+requests are counted, so a dead server does not pass for a fast one.
+
+On the server every poll is a fragment run of its own, which the single
+poller thread does not pay for. The async design therefore also reports how
+many fragment ticks the sessions would have made and their estimated CPU
+cost: ticks x the CPU time of one fragment-sized script run (AppTest,
+measured before the runs, or --tick-cost-ms).
+
+    python benchmarks/bench_concurrency.py --sessions 500
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+ANIMATION_SECONDS = 0.2 + 1.2
+POLL_INTERVAL = 0.4
+SAMPLE_INTERVAL = 0.05
+
+COMPLETION = {
+    "id": "chatcmpl-bench",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "gpt-4.1",
+    "choices": [{
+        "index": 0,
+        "message": {"role": "assistant", "content": "If I tried to do that here..."},
+        "finish_reason": "stop",
+    }],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+}
+# -----------------------------
+# Fake OpenAI server
+# -----------------------------
+async def handle(reader, writer, latency):
+    body = json.dumps(COMPLETION).encode()
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.decode("latin-1").split("\r\n"):
+                if line.lower().startswith("content-length:"):
+                    length = int(line.split(":", 1)[1])
+            await reader.readexactly(length)
+            await asyncio.sleep(latency)
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+def serve(port, latency):
+    async def main():
+        server = await asyncio.start_server(
+            lambda r, w: handle(r, w, latency), "127.0.0.1", port, backlog=4096
+        )
+        async with server:
+            await server.serve_forever()
+    asyncio.run(main())
+# -----------------------------
+# Sampling
+# -----------------------------
+def rss_mib():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+class Sampler:
+    def __init__(self):
+        self.peak_threads = 0
+        self.peak_rss = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            # the sampler itself is not counted
+            self.peak_threads = max(self.peak_threads, threading.active_count() - 1)
+            self.peak_rss = max(self.peak_rss, rss_mib())
+            time.sleep(SAMPLE_INTERVAL)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+# -----------------------------
+# Designs
+# -----------------------------
+MESSAGES = [{"role": "user", "content": "I walk my dog every morning."}]
+
+
+TICK_SCRIPT = """
+import streamlit as st
+with st.chat_message("assistant", avatar="🌍"):
+    st.empty().markdown("..")
+"""
+
+
+def measure_tick_cost(runs=200):
+    # CPU ms of one script run the size of a pending_reply tick
+    from streamlit.testing.v1 import AppTest
+    try:
+        from streamlit.runtime.scriptrunner_utils import script_run_context
+    except ImportError:  # streamlit < 1.38
+        from streamlit.runtime.scriptrunner import script_run_context
+
+    logging.getLogger(script_run_context.__name__).disabled = True
+    at = AppTest.from_string(TICK_SCRIPT)
+    at.run()
+    started = time.process_time()
+    for _ in range(runs):
+        at.run()
+    return (time.process_time() - started) * 1000 / runs
+
+
+def run_threaded(sessions):
+    from openai import OpenAI
+    failures = []
+
+    def session():
+        time.sleep(ANIMATION_SECONDS)
+        client = OpenAI(api_key="sk-bench")
+        try:
+            client.chat.completions.create(model="gpt-4.1", messages=MESSAGES, temperature=0.8)
+        except Exception as error:
+            failures.append(error)
+
+    threads = [threading.Thread(target=session) for _ in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # the previous design had no fragment: the script thread slept instead
+    return {"failed": len(failures), "fragment_ticks": 0}
+
+
+def run_async(sessions):
+    sys.path.insert(0, str(ROOT))
+    import llm_pipeline
+
+    started = time.time()
+    pending = [
+        llm_pipeline.submit_completion("sk-bench", "gpt-4.1", MESSAGES, 0.8)
+        for _ in range(sessions)
+    ]
+    # fragment ticks: each poll is a short script run, modelled on one thread
+    failed = 0
+    ticks = 0
+    while pending:
+        time.sleep(POLL_INTERVAL)
+        ticks += len(pending)
+        if time.time() - started >= ANIMATION_SECONDS:
+            done = [future for future in pending if future.done()]
+            failed += sum(future.exception() is not None for future in done)
+            pending = [future for future in pending if not future.done()]
+    llm_pipeline.get_loop().call_soon_threadsafe(llm_pipeline.get_loop().stop)
+    return {"failed": failed, "fragment_ticks": ticks}
+
+
+def measure(design, sessions, tick_cost_ms):
+    baseline_rss = rss_mib()
+    started = time.time()
+    cpu_before = time.process_time()
+    with Sampler() as sampler:
+        outcome = {"threaded": run_threaded, "async": run_async}[design](sessions)
+    wall_s = time.time() - started
+    fragment_cpu_s = outcome["fragment_ticks"] * tick_cost_ms / 1000
+    return {
+        "design": design,
+        "sessions": sessions,
+        "failed": outcome["failed"],
+        "peak_threads": sampler.peak_threads,
+        "peak_rss_mib": round(sampler.peak_rss, 1),
+        "rss_growth_mib": round(sampler.peak_rss - baseline_rss, 1),
+        "wall_s": round(wall_s, 2),
+        "cpu_s": round(time.process_time() - cpu_before, 2),
+        "fragment_ticks": outcome["fragment_ticks"],
+        "fragment_ticks_per_s": round(outcome["fragment_ticks"] / wall_s, 1),
+        "fragment_cpu_s_est": round(fragment_cpu_s, 2),
+        # cores kept busy by fragment runs alone
+        "fragment_cores_est": round(fragment_cpu_s / wall_s, 2),
+    }
+# -----------------------------
+# Orchestration
+# -----------------------------
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"fake OpenAI server did not start on port {port}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=2.0, help="fake model latency (s)")
+    parser.add_argument("--designs", nargs="+", choices=["threaded", "async"], default=["threaded", "async"])
+    parser.add_argument("--tick-cost-ms", type=float, help="CPU ms per fragment tick (default: measured)")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    parser.add_argument("--run", choices=["threaded", "async"], help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve, args.latency)
+        return 0
+    if args.run:
+        print(json.dumps(measure(args.run, args.sessions, args.tick_cost_ms or 0.0)))
+        return 0
+
+    tick_cost_ms = args.tick_cost_ms
+    if tick_cost_ms is None:
+        tick_cost_ms = measure_tick_cost()
+    print(f"fragment tick: {tick_cost_ms:.2f} CPU ms")
+
+    failed = 0
+    port = free_port()
+    env = dict(os.environ, OPENAI_BASE_URL=f"http://127.0.0.1:{port}/v1")
+    server = subprocess.Popen(
+        [sys.executable, __file__, "--serve", str(port), "--latency", str(args.latency)]
+    )
+    try:
+        wait_for_port(port)
+        for design in args.designs:
+            output = subprocess.run(
+                [
+                    sys.executable, __file__, "--run", design, "--sessions", str(args.sessions),
+                    "--tick-cost-ms", str(tick_cost_ms),
+                ],
+                env=env, check=True, capture_output=True, text=True,
+            ).stdout
+            result = output.strip().splitlines()[-1]
+            print(result)
+            failed += json.loads(result)["failed"]
+    finally:
+        server.terminate()
+        server.wait()
+    if failed:
+        print(f"{failed} request(s) failed; the numbers above do not measure successful turns")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
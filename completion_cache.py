@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime
+from pathlib import Path
+# -----------------------------
+# Record/replay cache for chat completions (development & demos)
+# -----------------------------
+# passthrough : always call the model, never touch the cache (default)
+# record      : replay when cached, otherwise call the model and store the reply
+# replay      : replay only; a miss raises CacheMiss instead of calling the model
+PASSTHROUGH = "passthrough"
+RECORD = "record"
+REPLAY = "replay"
+MODES = (PASSTHROUGH, RECORD, REPLAY)
+
+CACHE_DIR = ".completion_cache"
+MAX_MB = 200
+
+
+class CacheMiss(LookupError):
+    pass
+
+
+def normalize_messages(messages):
+    # only role/content reach the model; whitespace differences don't matter
+    return [
+        {"role": msg["role"], "content": " ".join(msg["content"].split())}
+        for msg in messages
+    ]
+
+
+def cache_key(messages, model, temperature):
+    payload = json.dumps(
+        {
+            "model": model,
+            "temperature": temperature,
+            "messages": normalize_messages(messages),
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    def __init__(self, mode=PASSTHROUGH, directory=CACHE_DIR, max_mb=MAX_MB):
+        if mode not in MODES:
+            raise ValueError(f"Unknown completion cache mode: {mode} (expected one of {MODES})")
+        self.mode = mode
+        self.directory = Path(directory)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+
+    def _path(self, key):
+        return self.directory / f"{key}.json"
+
+    def lookup(self, key):
+        path = self._path(key)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return None
+        # mtime doubles as last-used time for eviction; another process may
+        # have evicted the entry since the read, which is fine
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return entry["content"]
+
+    def store(self, key, content, model, temperature):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry = {
+            "content": content,
+            "model": model,
+            "temperature": temperature,
+            "recorded_at": datetime.utcnow().isoformat(),
+        }
+        # write-then-rename so a concurrent lookup never sees half a file
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp, self._path(key))
+        self.evict()
+
+    def evict(self):
+        # drop least recently used entries until the cache fits in max_bytes
+        entries = []
+        for path in self.directory.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
@@ -0,0 +1,148 @@
+import base64
+import hashlib
+import zlib
+from datetime import datetime
+# -----------------------------
+# Storage modes
+# -----------------------------
+# full_transcript : chat_logs per turn + the whole transcript in full_conversations at the end
+# append_only     : chat_logs per turn (with seq), one chat_sessions row, one small completion row
+FULL_TRANSCRIPT = "full_transcript"
+APPEND_ONLY = "append_only"
+STORAGE_MODES = (FULL_TRANSCRIPT, APPEND_ONLY)
+
+
+def check_storage_mode(mode):
+    if mode not in STORAGE_MODES:
+        raise ValueError(f"Unknown storage mode: {mode} (expected one of {STORAGE_MODES})")
+    return mode
+
+
+def parse_flag(value):
+    # secrets may hold a real bool or a string such as "false"
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("1", "true", "yes", "on"):
+        return True
+    if text in ("", "0", "false", "no", "off"):
+        return False
+    raise ValueError(f"Expected a true/false flag, got {value!r}")
+# -----------------------------
+# Content encoding
+# -----------------------------
+PLAIN = "plain"
+ZLIB_B64 = "zlib+b64"
+
+
+def prompt_version(system_prompt):
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:12]
+
+
+def encode_content(text, compress=False):
+    if not compress or text is None:
+        return text, PLAIN
+    packed = zlib.compress(text.encode("utf-8"), 9)
+    return base64.b64encode(packed).decode("ascii"), ZLIB_B64
+
+
+def admission_columns(input_tokens, input_trimmed):
+    # input_tokens / input_trimmed exist only after sql/input_admission.sql;
+    # callers pass input_tokens=None until then and the row leaves them out
+    if input_tokens is None:
+        return {}
+    return {"input_tokens": input_tokens, "input_trimmed": bool(input_trimmed)}
+
+
+def admission_totals(stats):
+    # per-session counts for the final save row (also sql/input_admission.sql)
+    if stats is None:
+        return {}
+    return {"input_messages": stats["messages"], "input_trimmed_messages": stats["trimmed"]}
+
+
+def decode_content(text, encoding):
+    if text is None or encoding in (None, PLAIN):
+        return text
+    if encoding == ZLIB_B64:
+        return zlib.decompress(base64.b64decode(text)).decode("utf-8")
+    raise ValueError(f"Unknown content encoding: {encoding}")
+# -----------------------------
+# Writes (append_only)
+# -----------------------------
+def start_session(supabase, finish_code, condition, system_prompt, welcome_message):
+    supabase.table("chat_sessions").insert({
+        "finish_code": finish_code,
+        "condition": condition,
+        "prompt_version": prompt_version(system_prompt),
+        "welcome_message": welcome_message,
+        "started_at": datetime.utcnow().isoformat()
+    }).execute()
+
+
+def append_turn(
+    supabase,
+    finish_code,
+    seq,
+    stage,
+    turn,
+    user_message,
+    assistant_message,
+    input_tokens=None,
+    input_trimmed=False,
+    compress=False
+):
+    user_content, encoding = encode_content(user_message, compress)
+    assistant_content, _ = encode_content(assistant_message, compress)
+    supabase.table("chat_logs").insert({
+        "finish_code": finish_code,
+        "seq": seq,
+        "stage": stage,
+        "turn": turn,
+        "user_message": user_content,
+        "assistant_message": assistant_content,
+        "content_encoding": encoding,
+        **admission_columns(input_tokens, input_trimmed)
+    }).execute()
+
+
+def complete_session(supabase, finish_code, turns, admission_stats=None):
+    return supabase.table("conversation_completions").insert({
+        "finish_code": finish_code,
+        "turns": turns,
+        "finished_at": datetime.utcnow().isoformat(),
+        **admission_totals(admission_stats)
+    }).execute()
+# -----------------------------
+# Reads (transcript on demand)
+# -----------------------------
+def load_transcript(supabase, finish_code):
+    session = (
+        supabase.table("chat_sessions")
+        .select("welcome_message")
+        .eq("finish_code", finish_code)
+        .limit(1)
+        .execute()
+    )
+    rows = (
+        supabase.table("chat_logs")
+        .select("seq, user_message, assistant_message, content_encoding")
+        .eq("finish_code", finish_code)
+        .order("seq")
+        .execute()
+    )
+
+    messages = []
+    if session.data:
+        messages.append(
+            {"role": "assistant", "content": session.data[0]["welcome_message"]}
+        )
+    for row in rows.data:
+        encoding = row.get("content_encoding")
+        messages.append(
+            {"role": "user", "content": decode_content(row["user_message"], encoding)}
+        )
+        messages.append(
+            {"role": "assistant", "content": decode_content(row["assistant_message"], encoding)}
+        )
+    return messages
@@ -0,0 +1,93 @@
+import tiktoken
+# -----------------------------
+# Budgets (tokens of participant input sent to the model)
+# -----------------------------
+MESSAGE_TOKEN_BUDGET = 400
+SESSION_TOKEN_BUDGET = 3000
+# once the session budget is spent, later messages still get this much
+MIN_MESSAGE_TOKENS = 60
+TRIM_MARKER = "\n\n[... {n} tokens omitted ...]\n\n"
+# gpt-4.1 tokenizer
+ENCODING_NAME = "o200k_base"
+# estimate used when the tokenizer file cannot be loaded
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+
+
+def get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding(ENCODING_NAME)
+        except Exception:
+            # BPE file not cached and not downloadable: fall back to estimates
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+# -----------------------------
+# Trimming: keep the start and the end of the message
+# -----------------------------
+def trim_to_budget(text, budget):
+    encoding = get_encoding()
+    if encoding is None:
+        units, decode, scale = text, str, CHARS_PER_TOKEN
+    else:
+        units = encoding.encode(text, disallowed_special=())
+        decode, scale = encoding.decode, 1
+    if len(units) <= budget * scale:
+        return text
+    # the marker is part of what is sent, so it comes out of the budget
+    # (formatted with the largest possible count, which has the most digits)
+    allowance = budget - count_tokens(TRIM_MARKER.format(n=len(units)))
+    while True:
+        head = max(allowance, 0) * 2 // 3
+        tail = max(allowance, 0) - head
+        head, tail = head * scale, tail * scale
+        omitted = -(-(len(units) - head - tail) // scale)
+        trimmed = (
+            decode(units[:head]).rstrip()
+            + TRIM_MARKER.format(n=omitted)
+            + (decode(units[-tail:]).lstrip() if tail else "")
+        )
+        # re-tokenising across the joins can add a token or two
+        excess = count_tokens(trimmed) - budget
+        if excess <= 0 or allowance <= 0:
+            return trimmed
+        allowance -= excess
+# -----------------------------
+# Admission
+# -----------------------------
+def admit(
+    text,
+    session_tokens,
+    message_budget=MESSAGE_TOKEN_BUDGET,
+    session_budget=SESSION_TOKEN_BUDGET
+):
+    # session_tokens = participant tokens already sent to the model this session
+    tokens = count_tokens(text)
+    allowance = min(
+        message_budget,
+        max(session_budget - session_tokens, MIN_MESSAGE_TOKENS)
+    )
+    if tokens <= allowance:
+        return {
+            "content": text,
+            "tokens": tokens,
+            "sent_tokens": tokens,
+            "trimmed": False
+        }
+
+    content = trim_to_budget(text, allowance)
+    return {
+        "content": content,
+        "tokens": tokens,
+        "sent_tokens": count_tokens(content),
+        "trimmed": True
+    }
@@ -0,0 +1,173 @@
+import asyncio
+import atexit
+import concurrent.futures
+import copy
+import logging
+import threading
+import time
+from openai import AsyncOpenAI
+from supabase import acreate_client
+import completion_cache
+# -----------------------------
+# Shared event loop
+# -----------------------------
+# One loop per server process. Sessions submit coroutines and get a
+# concurrent.futures.Future back; waiting requests hold a socket, not a thread.
+_loop = None
+_lock = threading.Lock()
+_openai_clients = {}
+_supabase_clients = {}
+_pending_writes = set()
+logger = logging.getLogger(__name__)
+
+INSERT_ATTEMPTS = 4
+INSERT_BACKOFF = 0.5  # seconds before the first retry, doubled after each
+FLUSH_TIMEOUT = 10  # seconds to wait for queued inserts at interpreter exit
+
+
+def get_loop():
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="llm-pipeline", daemon=True
+            ).start()
+    return _loop
+
+
+def submit(coro):
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+# -----------------------------
+# Clients (created on the loop, reused by every session)
+# -----------------------------
+def _openai_client(api_key):
+    if api_key not in _openai_clients:
+        _openai_clients[api_key] = AsyncOpenAI(api_key=api_key)
+    return _openai_clients[api_key]
+
+
+async def _supabase_client(url, key):
+    if (url, key) not in _supabase_clients:
+        _supabase_clients[(url, key)] = asyncio.ensure_future(acreate_client(url, key))
+    client = _supabase_clients[(url, key)]
+    try:
+        return await client
+    except Exception:
+        # don't keep a failed connect around; the next attempt starts a new one
+        if _supabase_clients.get((url, key)) is client:
+            del _supabase_clients[(url, key)]
+        raise
+# -----------------------------
+# OpenAI
+# -----------------------------
+async def _complete(api_key, model, messages, temperature):
+    response = await _openai_client(api_key).chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+    )
+    return response.choices[0].message.content
+
+
+async def _complete_and_record(cache, key, api_key, model, messages, temperature):
+    content = await _complete(api_key, model, messages, temperature)
+    await asyncio.to_thread(cache.store, key, content, model, temperature)
+    return content
+
+
+def submit_completion(api_key, model, messages, temperature, cache=None):
+    if cache is None or cache.mode == completion_cache.PASSTHROUGH:
+        return submit(_complete(api_key, model, messages, temperature))
+
+    key = completion_cache.cache_key(messages, model, temperature)
+    content = cache.lookup(key)
+    if content is not None or cache.mode == completion_cache.REPLAY:
+        future = concurrent.futures.Future()
+        if content is not None:
+            future.set_result(content)
+        else:
+            future.set_exception(completion_cache.CacheMiss(
+                f"No recorded completion for key {key} (completion cache is replay-only)"
+            ))
+        return future
+    return submit(_complete_and_record(cache, key, api_key, model, messages, temperature))
+# -----------------------------
+# Supabase (fire-and-forget inserts, retried with backoff)
+# -----------------------------
+async def _insert(url, key, table, row):
+    delay = INSERT_BACKOFF
+    for attempt in range(1, INSERT_ATTEMPTS + 1):
+        try:
+            client = await _supabase_client(url, key)
+            return await client.table(table).insert(row).execute()
+        except Exception as error:
+            if attempt == INSERT_ATTEMPTS:
+                raise
+            logger.warning(
+                "insert into %s failed (attempt %d/%d): %r; retrying in %ss",
+                table, attempt, INSERT_ATTEMPTS, error, delay
+            )
+            await asyncio.sleep(delay)
+            delay *= 2
+
+
+def _write_done(future):
+    _pending_writes.discard(future)
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Supabase insert failed", exc_info=future.exception())
+
+
+def submit_insert(url, key, table, row):
+    # copy now: the caller may keep mutating session_state after we return
+    future = submit(_insert(url, key, table, copy.deepcopy(row)))
+    _pending_writes.add(future)
+    future.add_done_callback(_write_done)
+    return future
+
+
+def flush(timeout=None):
+    # wait for queued inserts (retries included); returns how many are left
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for future in list(_pending_writes):
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        try:
+            future.exception(timeout=remaining)
+        except concurrent.futures.TimeoutError:
+            break
+    return sum(not future.done() for future in list(_pending_writes))
+
+
+def _flush_at_exit():
+    left = flush(FLUSH_TIMEOUT)
+    if left:
+        logger.warning("%d Supabase insert(s) still pending at exit", left)
+
+
+# the loop thread is a daemon: give queued inserts a chance before it dies
+atexit.register(_flush_at_exit)
+
+
+class SupabaseWriter:
+    # Stands in for the sync client in insert_log / conversation_store writes:
+    # supabase.table(name).insert(row).execute() queues the insert on the loop.
+    def __init__(self, url, key):
+        self.url = url
+        self.key = key
+
+    def table(self, name):
+        return _TableInsert(self, name)
+
+
+class _TableInsert:
+    def __init__(self, writer, table):
+        self.writer = writer
+        self.table = table
+        self.row = None
+
+    def insert(self, row):
+        self.row = row
+        return self
+
+    def execute(self):
+        return submit_insert(self.writer.url, self.writer.key, self.table, self.row)
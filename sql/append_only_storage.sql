@@ -0,0 +1,58 @@
+-- -----------------------------
+-- Append-only conversation storage (STORAGE_MODE = "append_only")
+-- -----------------------------
+-- chat_logs keeps one row per user/assistant pair; seq orders the pairs within a session
+alter table chat_logs add column if not exists seq integer;
+alter table chat_logs add column if not exists content_encoding text default 'plain';
+
+create index if not exists chat_logs_finish_code_seq_idx on chat_logs (finish_code, seq);
+
+-- One row per session: condition and system prompt version are recorded once
+create table if not exists chat_sessions (
+    id bigint generated by default as identity primary key,
+    finish_code text not null,
+    condition text,
+    prompt_version text,
+    welcome_message text,
+    started_at timestamptz,
+    created_at timestamptz default now()
+);
+
+-- Small completion record written when the finish code is given
+create table if not exists conversation_completions (
+    id bigint generated by default as identity primary key,
+    finish_code text not null,
+    turns integer,
+    finished_at timestamptz,
+    created_at timestamptz default now()
+);
+
+-- -----------------------------
+-- Full transcripts on demand
+-- -----------------------------
+-- Same shape as full_conversations.full_conversation. Rows stored with
+-- content_encoding = 'zlib+b64' come back encoded; use
+-- conversation_store.load_transcript() to read those.
+create or replace view full_conversations_view as
+select
+    s.finish_code,
+    s.condition,
+    s.prompt_version,
+    jsonb_build_array(
+        jsonb_build_object('role', 'assistant', 'content', s.welcome_message)
+    ) || coalesce(
+        (
+            select jsonb_agg(m.message order by l.seq, m.ord)
+            from chat_logs l
+            cross join lateral (
+                values
+                    (0, jsonb_build_object('role', 'user', 'content', l.user_message)),
+                    (1, jsonb_build_object('role', 'assistant', 'content', l.assistant_message))
+            ) as m(ord, message)
+            where l.finish_code = s.finish_code
+        ),
+        '[]'::jsonb
+    ) as full_conversation,
+    c.finished_at
+from chat_sessions s
+left join conversation_completions c on c.finish_code = s.finish_code;
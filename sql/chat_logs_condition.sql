@@ -0,0 +1,8 @@
+-- -----------------------------
+-- Condition on every chat_logs row (STORAGE_MODE = "full_transcript")
+-- -----------------------------
+-- append_only records the condition once in chat_sessions. full_transcript
+-- has no session row, and stage-1 replies carry no assistant identifier, so
+-- without this column sessions that end at the welcome step have no condition.
+-- Run this before setting LOG_CONDITION = true in .streamlit/secrets.toml.
+alter table chat_logs add column if not exists condition text;
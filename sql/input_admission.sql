@@ -0,0 +1,30 @@
+-- -----------------------------
+-- Input admission (token budgets for participant messages)
+-- -----------------------------
+-- input_tokens  : tokens in the participant's original message
+-- input_trimmed : true when a shortened version was sent to the model
+-- Run this before setting LOG_INPUT_ADMISSION = true in .streamlit/secrets.toml;
+-- until then the apps leave these columns out of their inserts.
+alter table chat_logs add column if not exists input_tokens integer;
+alter table chat_logs add column if not exists input_trimmed boolean default false;
+
+-- Per session, on the row written when the finish code is given
+-- (full_conversations, or conversation_completions with STORAGE_MODE = append_only)
+-- input_messages         : participant messages in the session
+-- input_trimmed_messages : how many of them were over budget
+alter table if exists full_conversations add column if not exists input_messages integer;
+alter table if exists full_conversations add column if not exists input_trimmed_messages integer;
+alter table if exists conversation_completions add column if not exists input_messages integer;
+alter table if exists conversation_completions add column if not exists input_trimmed_messages integer;
+
+-- How often the budget is hit, per day
+create or replace view input_admission_stats as
+select
+    date_trunc('day', created_at) as day,
+    count(*) as messages,
+    count(*) filter (where input_trimmed) as trimmed,
+    round(avg(case when input_trimmed then 1.0 else 0.0 end), 4) as trimmed_rate,
+    max(input_tokens) as max_input_tokens
+from chat_logs
+group by 1
+order by 1;
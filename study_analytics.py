@@ -0,0 +1,354 @@
+import argparse
+import json
+import os
+import tomllib
+from pathlib import Path
+import pandas as pd
+from postgrest.exceptions import APIError
+from supabase import create_client
+import conversation_store
+# -----------------------------
+# Study-funnel analytics over chat_logs / full_conversations
+# -----------------------------
+# Tables are read in id order, CHUNK_SIZE rows per request. Each table's
+# prepared rows are cached on disk with its high-water mark (max id), so a
+# rerun only fetches and prepares rows with a larger id.
+CHUNK_SIZE = 1000
+CACHE_DIR = Path(".analytics_cache")
+SECRETS_PATH = Path(".streamlit/secrets.toml")
+
+CHAT_LOG_COLUMNS = ["id", "finish_code", "stage", "turn", "created_at", "user_message", "assistant_message"]
+OPTIONAL_CHAT_LOG_COLUMNS = ["seq", "content_encoding", "input_tokens", "input_trimmed", "condition"]
+COMPLETION_TABLES = {
+    "full_conversations": ["id", "finish_code", "finished_at"],
+    "conversation_completions": ["id", "finish_code", "finished_at"],
+}
+SESSION_COLUMNS = ["id", "finish_code", "condition"]
+# the assistant's identifier tells the condition apart when there is no
+# chat_sessions row (STORAGE_MODE = full_transcript) and no chat_logs.condition
+# (sql/chat_logs_condition.sql). Stage-1 replies carry no identifier, so
+# sessions that end at the welcome step then stay "unknown".
+CONDITION_PREFIXES = {
+    "👤 Alex": "embodiment",
+    "🤖 Sustainability AI assistant": "no_embodiment",
+}
+FINISH_CODE_MARKER = "Your finish code is"
+UNKNOWN_CONDITION = "unknown"
+# (stage, turn) points the apps log: the welcome stage is always turn 0 and
+# the conversation stage counts turns from 1
+WELCOME_POINT = (1, 0)
+CONVERSATION_STAGE = 2
+# PostgREST / Postgres codes for a table or column that has not been migrated yet
+MISSING_RELATION_CODES = {"42P01", "PGRST205", "42703", "PGRST204"}
+# -----------------------------
+# Loading (chunked, incremental)
+# -----------------------------
+def fetch_chunks(client, table, columns, after_id=0, chunk_size=CHUNK_SIZE):
+    while True:
+        rows = (
+            client.table(table)
+            .select(", ".join(columns))
+            .gt("id", after_id)
+            .order("id")
+            .limit(chunk_size)
+            .execute()
+            .data
+        )
+        if not rows:
+            return
+        yield pd.DataFrame(rows, columns=columns)
+        after_id = rows[-1]["id"]
+        if len(rows) < chunk_size:
+            return
+
+
+def is_missing_relation(error):
+    return error.code in MISSING_RELATION_CODES
+
+
+def table_columns(client, table, columns, optional=()):
+    # optional columns come from later migrations (sql/*.sql)
+    available = list(columns)
+    for column in optional:
+        try:
+            client.table(table).select(column).limit(1).execute()
+            available.append(column)
+        except APIError as error:
+            if not is_missing_relation(error):
+                raise
+    return available
+
+
+def load_table(client, table, columns, prepare, cache_dir=CACHE_DIR, optional=()):
+    cache_dir = Path(cache_dir)
+    data_path = cache_dir / f"{table}.pkl"
+    meta_path = cache_dir / f"{table}.json"
+
+    cached = None
+    high_water = 0
+    if data_path.exists() and meta_path.exists():
+        cached = pd.read_pickle(data_path)
+        high_water = json.loads(meta_path.read_text())["high_water"]
+
+    columns = table_columns(client, table, columns, optional)
+    new = [prepare(chunk) for chunk in fetch_chunks(client, table, columns, high_water)]
+    if not new:
+        return cached if cached is not None else prepare(pd.DataFrame(columns=columns))
+
+    frames = ([cached] if cached is not None else []) + new
+    result = pd.concat(frames, ignore_index=True)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    result.to_pickle(data_path)
+    meta_path.write_text(json.dumps({"high_water": int(result["id"].max())}))
+    return result
+# -----------------------------
+# Per-chunk preparation
+# -----------------------------
+def decode_messages(df):
+    if "content_encoding" not in df:
+        return df
+    encoded = df["content_encoding"].fillna(conversation_store.PLAIN) != conversation_store.PLAIN
+    if encoded.any():
+        df = df.copy()
+        for column in ("user_message", "assistant_message"):
+            df.loc[encoded, column] = [
+                conversation_store.decode_content(text, encoding)
+                for text, encoding in zip(df.loc[encoded, column], df.loc[encoded, "content_encoding"])
+            ]
+    return df
+
+
+def prepare_chat_logs(df):
+    df = decode_messages(df)
+    assistant = df["assistant_message"].fillna("").astype(str)
+    user = df["user_message"].fillna("").astype(str)
+
+    condition = pd.Series(pd.NA, index=df.index, dtype="string")
+    stripped = assistant.str.lstrip()
+    for prefix, name in CONDITION_PREFIXES.items():
+        condition = condition.mask(stripped.str.startswith(prefix), name)
+    if "condition" in df:
+        condition = df["condition"].astype("string").combine_first(condition)
+
+    prepared = pd.DataFrame({
+        "id": df["id"].astype("int64"),
+        "finish_code": df["finish_code"].astype("string"),
+        "stage": pd.to_numeric(df["stage"], errors="coerce").astype("Int64"),
+        "turn": pd.to_numeric(df["turn"], errors="coerce").astype("Int64"),
+        "created_at": pd.to_datetime(df["created_at"], utc=True, format="ISO8601"),
+        "user_chars": user.str.len(),
+        "assistant_chars": assistant.str.len(),
+        "assistant_words": assistant.str.split().str.len().fillna(0).astype("int64"),
+        "gave_code": assistant.str.contains(FINISH_CODE_MARKER, regex=False),
+        "condition_hint": condition,
+    })
+    if "input_trimmed" in df:
+        prepared["input_trimmed"] = df["input_trimmed"].fillna(False).astype(bool)
+    return prepared
+
+
+def prepare_completions(df):
+    return pd.DataFrame({
+        "id": df["id"].astype("int64"),
+        "finish_code": df["finish_code"].astype("string"),
+        "finished_at": pd.to_datetime(df["finished_at"], utc=True, format="ISO8601"),
+    })
+
+
+def prepare_session_rows(df):
+    return pd.DataFrame({
+        "id": df["id"].astype("int64"),
+        "finish_code": df["finish_code"].astype("string"),
+        "condition": df["condition"].astype("string"),
+    })
+
+
+def load_chat_logs(client, cache_dir=CACHE_DIR):
+    return load_table(
+        client, "chat_logs", CHAT_LOG_COLUMNS, prepare_chat_logs,
+        cache_dir=cache_dir, optional=OPTIONAL_CHAT_LOG_COLUMNS
+    )
+
+
+def load_completions(client, cache_dir=CACHE_DIR):
+    frames = []
+    for table, columns in COMPLETION_TABLES.items():
+        try:
+            frames.append(load_table(client, table, columns, prepare_completions, cache_dir=cache_dir))
+        except APIError as error:
+            # conversation_completions only exists with STORAGE_MODE = append_only
+            if not is_missing_relation(error):
+                raise
+    if not frames:
+        return prepare_completions(pd.DataFrame(columns=COMPLETION_TABLES["full_conversations"]))
+    return pd.concat(frames, ignore_index=True).drop_duplicates("finish_code")
+
+
+def load_session_rows(client, cache_dir=CACHE_DIR):
+    try:
+        return load_table(client, "chat_sessions", SESSION_COLUMNS, prepare_session_rows, cache_dir=cache_dir)
+    except APIError as error:
+        # chat_sessions only exists with STORAGE_MODE = append_only
+        if not is_missing_relation(error):
+            raise
+        return prepare_session_rows(pd.DataFrame(columns=SESSION_COLUMNS))
+# -----------------------------
+# Aggregations (grouped, vectorized)
+# -----------------------------
+def sessions(logs, completions, session_rows):
+    grouped = logs.groupby("finish_code", sort=False)
+    result = grouped.agg(
+        condition=("condition_hint", "first"),
+        max_stage=("stage", "max"),
+        max_turn=("turn", "max"),
+        turns=("id", "size"),
+        gave_code=("gave_code", "any"),
+        first_at=("created_at", "min"),
+        last_at=("created_at", "max"),
+    )
+    recorded = session_rows.drop_duplicates("finish_code").set_index("finish_code")["condition"]
+    result["condition"] = (
+        result.index.to_series().map(recorded).combine_first(result["condition"]).fillna(UNKNOWN_CONDITION)
+    )
+    result["completed"] = result["gave_code"] | result.index.isin(completions["finish_code"])
+    result["duration_s"] = (result["last_at"] - result["first_at"]).dt.total_seconds()
+    return result
+
+
+def funnel(session_table):
+    # sessions that reached at least each (stage, turn), per condition
+    keys = ["condition", "max_stage", "max_turn"]
+    ended = session_table.groupby(keys).size().rename("ended_here")
+    if ended.empty:
+        return pd.DataFrame(columns=keys + ["ended_here", "reached", "reached_share"])
+    # every point the apps can log, so points nobody ended at still get a row
+    stages = ended.index.get_level_values("max_stage")
+    turns = ended.index.get_level_values("max_turn")
+    conversation_turns = turns[stages == CONVERSATION_STAGE]
+    last_turn = int(conversation_turns.max()) if len(conversation_turns) else 0
+    points = [WELCOME_POINT] + [(CONVERSATION_STAGE, turn) for turn in range(1, last_turn + 1)]
+    valid = pd.MultiIndex.from_tuples(
+        [
+            (condition, stage, turn)
+            for condition in ended.index.get_level_values("condition").unique()
+            for stage, turn in points
+        ],
+        names=keys,
+    )
+    reached = (
+        # observed points outside the scheme are kept so no session is lost
+        ended.reindex(valid.union(ended.index), fill_value=0)
+        .reset_index()
+        .sort_values(keys, ascending=[True, False, False])
+    )
+    reached["reached"] = reached.groupby("condition")["ended_here"].cumsum()
+    totals = session_table.groupby("condition").size()
+    reached["reached_share"] = reached["reached"] / reached["condition"].map(totals)
+    return reached.sort_values(["condition", "max_stage", "max_turn"]).reset_index(drop=True)
+
+
+def dropout(session_table):
+    dropped = session_table[~session_table["completed"]]
+    result = (
+        dropped.groupby(["condition", "max_stage", "max_turn"])
+        .size()
+        .rename("dropped")
+        .reset_index()
+    )
+    started = session_table.groupby("condition").size()
+    result["dropped_share"] = result["dropped"] / result["condition"].map(started)
+    return result
+
+
+def with_condition(logs, session_table):
+    return logs.assign(condition=logs["finish_code"].map(session_table["condition"]))
+
+
+def response_lengths(logs, session_table):
+    return (
+        with_condition(logs, session_table)
+        .groupby(["condition", "stage", "turn"])["assistant_words"]
+        .describe(percentiles=[0.5, 0.9])
+        .reset_index()
+    )
+
+
+def turn_gaps(logs, session_table):
+    ordered = with_condition(logs, session_table).sort_values(["finish_code", "created_at"])
+    ordered["gap_s"] = ordered.groupby("finish_code")["created_at"].diff().dt.total_seconds()
+    return (
+        ordered.dropna(subset=["gap_s"])
+        .groupby(["condition", "stage", "turn"])["gap_s"]
+        .describe(percentiles=[0.5, 0.9])
+        .reset_index()
+    )
+
+
+def admission_rate(logs, session_table):
+    if "input_trimmed" not in logs:
+        return pd.DataFrame(columns=["condition", "messages", "trimmed", "trimmed_share"])
+    trimmed = with_condition(logs, session_table).assign(
+        input_trimmed=logs["input_trimmed"].fillna(False).astype(bool)
+    )
+    grouped = trimmed.groupby("condition")["input_trimmed"]
+    return pd.DataFrame({
+        "messages": grouped.size(),
+        "trimmed": grouped.sum(),
+        "trimmed_share": grouped.mean(),
+    }).reset_index()
+
+
+def report(client, cache_dir=CACHE_DIR):
+    logs = load_chat_logs(client, cache_dir)
+    completions = load_completions(client, cache_dir)
+    session_table = sessions(logs, completions, load_session_rows(client, cache_dir))
+    return {
+        "sessions": session_table,
+        "funnel": funnel(session_table),
+        "dropout": dropout(session_table),
+        "response_lengths": response_lengths(logs, session_table),
+        "turn_gaps": turn_gaps(logs, session_table),
+        "admission": admission_rate(logs, session_table),
+    }
+# -----------------------------
+# CLI
+# -----------------------------
+def supabase_from_env():
+    url = os.environ.get("SUPABASE_URL")
+    key = os.environ.get("SUPABASE_SERVICE_KEY")
+    if not (url and key) and SECRETS_PATH.exists():
+        secrets = tomllib.loads(SECRETS_PATH.read_text())
+        url = url or secrets.get("SUPABASE_URL")
+        key = key or secrets.get("SUPABASE_SERVICE_KEY")
+    if not (url and key):
+        raise SystemExit("Set SUPABASE_URL and SUPABASE_SERVICE_KEY (env or .streamlit/secrets.toml)")
+    return create_client(url, key)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Study-funnel analytics over chat_logs")
+    parser.add_argument("--cache-dir", type=Path, default=CACHE_DIR)
+    parser.add_argument("--out", type=Path, help="write each table as CSV into this directory")
+    args = parser.parse_args(argv)
+
+    tables = report(supabase_from_env(), args.cache_dir)
+    unknown = int((tables["sessions"]["condition"] == UNKNOWN_CONDITION).sum())
+    if unknown:
+        print(
+            f"note: {unknown} session(s) have no recorded condition and are reported as "
+            f"'{UNKNOWN_CONDITION}'. Without chat_sessions or chat_logs.condition the condition "
+            "comes from the assistant's identifier, which stage-1 replies lack, so stage-1 "
+            "drop-outs cannot be split by condition (see sql/chat_logs_condition.sql)."
+        )
+    for name, table in tables.items():
+        if name == "sessions":
+            continue
+        print(f"\n== {name} ==")
+        print(table.to_string(index=False))
+        if args.out:
+            args.out.mkdir(parents=True, exist_ok=True)
+            table.to_csv(args.out / f"{name}.csv", index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import study_analytics  # noqa: E402
+
+ALEX = "👤 Alex: "
+ASSISTANT = "🤖 Sustainability AI assistant: "
+
+
+def chat_logs(rows, with_condition=False):
+    # rows: (finish_code, stage, turn, assistant_message, condition)
+    raw = pd.DataFrame(
+        [
+            {
+                "id": i + 1,
+                "finish_code": code,
+                "stage": stage,
+                "turn": turn,
+                "created_at": f"2026-01-01T00:{i:02d}:00+00:00",
+                "user_message": "hi",
+                "assistant_message": reply,
+                "condition": condition,
+            }
+            for i, (code, stage, turn, reply, condition) in enumerate(rows)
+        ]
+    )
+    if not with_condition:
+        raw = raw.drop(columns="condition")
+    return study_analytics.prepare_chat_logs(raw)
+
+
+def session_table(logs):
+    completions = study_analytics.prepare_completions(
+        pd.DataFrame(columns=["id", "finish_code", "finished_at"])
+    )
+    session_rows = study_analytics.prepare_session_rows(
+        pd.DataFrame(columns=study_analytics.SESSION_COLUMNS)
+    )
+    return study_analytics.sessions(logs, completions, session_rows)
+
+
+ROWS = [
+    # embodiment: one drop-out at the welcome step, one reaches turn 3
+    ("11111", 1, 0, "Are you ready?", "embodiment"),
+    ("22222", 2, 1, ALEX + "Hello from 2060.", "embodiment"),
+    ("22222", 2, 2, ALEX + "The heat...", "embodiment"),
+    ("22222", 2, 3, ALEX + "Your finish code is **22222**.", "embodiment"),
+    # no_embodiment: one session that stops at turn 1
+    ("33333", 2, 1, ASSISTANT + "Hello.", "no_embodiment"),
+]
+
+
+def test_funnel_has_only_points_the_apps_log():
+    result = study_analytics.funnel(session_table(chat_logs(ROWS, with_condition=True)))
+
+    points = set(zip(result["max_stage"], result["max_turn"]))
+    assert points == {(1, 0), (2, 1), (2, 2), (2, 3)}
+
+    embodiment = result[result["condition"] == "embodiment"].set_index(["max_stage", "max_turn"])
+    assert embodiment["reached"].to_dict() == {(1, 0): 2, (2, 1): 1, (2, 2): 1, (2, 3): 1}
+    assert embodiment.loc[(2, 1), "reached_share"] == 0.5
+
+    no_embodiment = result[result["condition"] == "no_embodiment"].set_index(["max_stage", "max_turn"])
+    assert no_embodiment["reached"].to_dict() == {(1, 0): 1, (2, 1): 1, (2, 2): 0, (2, 3): 0}
+
+
+def test_sessions_use_logged_condition_for_welcome_dropouts():
+    table = session_table(chat_logs(ROWS, with_condition=True))
+    assert table.loc["11111", "condition"] == "embodiment"
+    assert bool(table.loc["22222", "completed"])
+
+
+def test_sessions_without_logged_condition_leave_welcome_dropouts_unknown():
+    table = session_table(chat_logs(ROWS))
+    assert table.loc["11111", "condition"] == study_analytics.UNKNOWN_CONDITION
+    assert table.loc["22222", "condition"] == "embodiment"
+    assert table.loc["33333", "condition"] == "no_embodiment"